@@ -8,6 +8,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 DB_PATH = os.path.join(DATA_DIR, 'charts.db')
 IMAGES_DIR = os.path.join(DATA_DIR, 'images')
+MOSAICS_DIR = os.path.join(DATA_DIR, 'mosaics')
 
 def full_reset():
     print("WARNING: This will delete all data (database and images).")
@@ -43,7 +44,15 @@ def full_reset():
         except Exception as e:
             print(f"Error clearing images directory: {e}")
     
-    # 3. Re-initialize DB (optional, but helpful)
+    # 3. Remove cached mosaics (chart ids restart with the new database)
+    if os.path.exists(MOSAICS_DIR):
+        try:
+            shutil.rmtree(MOSAICS_DIR)
+            print(f"Deleted mosaic cache: {MOSAICS_DIR}")
+        except Exception as e:
+            print(f"Error deleting mosaic cache: {e}")
+
+    # 4. Re-initialize DB (optional, but helpful)
     print("Re-initializing empty database...")
     try:
         # Add src to sys.path to import db module
@@ -1,10 +1,22 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 import os
+import json
+import time
 import db
+import mosaic
 
 app = Flask(__name__)
 IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'images')
 
+# The downloader writes from a separate process, so the stream polls the
+# change log rather than relying on in-process notifications.
+STREAM_POLL_SECONDS = 2
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Create tables added since the database was first made (e.g. changes), however
+# the app is started
+db.init_db()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -13,21 +25,93 @@ def index():
 def serve_image(filename):
     return send_from_directory(IMAGES_DIR, filename)
 
+@app.route('/mosaics/<filename>')
+def serve_mosaic(filename):
+    # Mosaic keys cover the chart image filenames (which are never reused) and
+    # which of them were missing, so a given filename always refers to the same image
+    return send_from_directory(mosaic.MOSAICS_DIR, filename, max_age=31536000)
+
+def chart_filters():
+    tags_str = request.args.get('tags')
+    return {
+        'ticker': request.args.get('ticker'),
+        'date_start': request.args.get('date_start'),
+        'date_end': request.args.get('date_end'),
+        'tags': tags_str.split(',') if tags_str else None,
+        'latest_per_ticker': request.args.get('latest_per_ticker') == 'true',
+        'tag_operator': request.args.get('tag_operator', 'OR'),
+        'period': request.args.get('period'),
+    }
+
 @app.route('/api/charts')
 def api_charts():
-    ticker = request.args.get('ticker')
-    date_start = request.args.get('date_start')
-    date_end = request.args.get('date_end')
-    
-    tags_str = request.args.get('tags')
-    tags = tags_str.split(',') if tags_str else None
-    
-    latest_per_ticker = request.args.get('latest_per_ticker') == 'true'
-    tag_operator = request.args.get('tag_operator', 'OR')
-    period = request.args.get('period')
-    
-    charts = db.get_charts(ticker, date_start, date_end, tags, latest_per_ticker, tag_operator, period)
-    return jsonify(charts)
+    # Read the generation first so a change landing mid-query is replayed, not lost
+    generation = db.get_generation()
+    charts = db.get_charts(**chart_filters())
+    response = jsonify(charts)
+    response.headers['X-Charts-Generation'] = str(generation)
+    return response
+
+@app.route('/api/charts/stream')
+def api_charts_stream():
+    # EventSource sends Last-Event-ID when it reconnects on its own
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    current = db.get_generation()
+    try:
+        generation = int(since)
+    except (TypeError, ValueError):
+        generation = current
+
+    # A generation ahead of the log means it was reset (e.g. by full_reset.py),
+    # so the client's view is stale and must be re-fetched
+    reset = generation > current
+    if reset:
+        generation = current
+
+    def stream(generation):
+        if reset:
+            yield f"id: {generation}\nevent: reset\ndata: {json.dumps({'generation': generation})}\n\n"
+        last_sent = time.monotonic()
+        while True:
+            changes = db.get_changes_since(generation)
+            for change in changes:
+                generation = change['generation']
+                yield f"id: {generation}\nevent: {change['kind']}\ndata: {json.dumps(change)}\n\n"
+            if changes:
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(STREAM_POLL_SECONDS)
+
+    return Response(stream(generation), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/charts/mosaic')
+def api_charts_mosaic():
+    try:
+        columns = int(request.args.get('columns', mosaic.DEFAULT_COLUMNS))
+        tile_width = int(request.args.get('tile_width', mosaic.DEFAULT_TILE_WIDTH))
+    except ValueError:
+        return jsonify({'error': 'columns and tile_width must be integers'}), 400
+    if not 1 <= columns <= 10 or not 100 <= tile_width <= 1200:
+        return jsonify({'error': 'columns must be 1-10 and tile_width 100-1200'}), 400
+
+    fmt = request.args.get('format', 'jpeg')
+    if fmt not in mosaic.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(mosaic.FORMATS)}"}), 400
+
+    filters = chart_filters()
+    charts = db.get_charts(**filters)
+    size_error = mosaic.sheet_size_error(len(charts), columns, tile_width, fmt)
+    if size_error:
+        return jsonify({'error': size_error}), 400
+    mosaic_map = mosaic.get_mosaic(charts, filters, columns, tile_width, fmt)
+    mosaic_map['image_url'] = f"/mosaics/{mosaic_map['image']}"
+    return jsonify(mosaic_map)
 
 @app.route('/api/tags', methods=['POST'])
 def api_add_tag():
@@ -10,6 +10,7 @@ def get_db_connection():
     return conn
 
 def init_db():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -37,6 +38,18 @@ def init_db():
         )
     ''')
 
+    # Create change log table. Its id doubles as the generation counter that
+    # stream clients use to resume from their last-seen change.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            chart_id INTEGER NOT NULL,
+            tag_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
     # Create indexes
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_charts_ticker ON charts(ticker)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_charts_date ON charts(chart_date)')
@@ -48,6 +61,10 @@ def init_db():
     conn.close()
     print(f"Database initialized at {DB_PATH}")
 
+def _record_change(cursor, kind, chart_id, tag_name=None):
+    # kind is one of 'chart', 'tag_added', 'tag_removed'
+    cursor.execute('INSERT INTO changes (kind, chart_id, tag_name) VALUES (?, ?, ?)', (kind, chart_id, tag_name))
+
 def add_chart(ticker, chart_date, image_filename, original_url, period=None):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -56,6 +73,7 @@ def add_chart(ticker, chart_date, image_filename, original_url, period=None):
         VALUES (?, ?, ?, ?, ?)
     ''', (ticker, chart_date, image_filename, original_url, period))
     chart_id = cursor.lastrowid
+    _record_change(cursor, 'chart', chart_id)
     conn.commit()
     conn.close()
     return chart_id
@@ -65,6 +83,7 @@ def add_tag(chart_id, tag_name):
     cursor = conn.cursor()
     try:
         cursor.execute('INSERT INTO tags (chart_id, tag_name) VALUES (?, ?)', (chart_id, tag_name))
+        _record_change(cursor, 'tag_added', chart_id, tag_name)
         conn.commit()
     except sqlite3.IntegrityError:
         pass # Tag already exists for this chart
@@ -75,6 +94,8 @@ def remove_tag(chart_id, tag_name):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM tags WHERE chart_id = ? AND tag_name = ?', (chart_id, tag_name))
+    if cursor.rowcount > 0:
+        _record_change(cursor, 'tag_removed', chart_id, tag_name)
     conn.commit()
     conn.close()
 
@@ -176,5 +197,49 @@ def get_all_tags():
     conn.close()
     return [dict(tag) for tag in tags]
 
+def get_generation():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM changes')
+    generation = cursor.fetchone()[0]
+    conn.close()
+    return generation
+
+def get_changes_since(generation, limit=500):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # New chart rows are joined in so clients can render them without another request
+    cursor.execute('''
+        SELECT ch.id as generation, ch.kind, ch.chart_id, ch.tag_name,
+               c.ticker, c.chart_date, c.image_filename, c.original_url, c.period, c.created_at
+        FROM changes ch
+        LEFT JOIN charts c ON ch.kind = 'chart' AND c.id = ch.chart_id
+        WHERE ch.id > ?
+        ORDER BY ch.id
+        LIMIT ?
+    ''', (generation, limit))
+    rows = cursor.fetchall()
+    conn.close()
+
+    changes = []
+    for row in rows:
+        change = {'generation': row['generation'], 'kind': row['kind'], 'chart_id': row['chart_id']}
+        if row['kind'] == 'chart':
+            # chart is None if the row was deleted after it was added
+            change['chart'] = None if row['ticker'] is None else {
+                'id': row['chart_id'],
+                'ticker': row['ticker'],
+                'chart_date': row['chart_date'],
+                'image_filename': row['image_filename'],
+                'original_url': row['original_url'],
+                'period': row['period'],
+                'created_at': row['created_at'],
+                'tags': None,
+            }
+        else:
+            change['tag_name'] = row['tag_name']
+        changes.append(change)
+    return changes
+
 if __name__ == '__main__':
     init_db()
@@ -160,6 +160,9 @@ def main():
     with open(args.urls, 'r') as f:
         urls = [line.strip() for line in f if line.strip()]
 
+    # Make sure tables added since the database was created (e.g. changes) exist
+    db.init_db()
+
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True) # Set headless=False to debug
         context = browser.new_context()
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import tempfile
+from functools import lru_cache
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+IMAGES_DIR = os.path.join(DATA_DIR, 'images')
+MOSAICS_DIR = os.path.join(DATA_DIR, 'mosaics')
+
+DEFAULT_COLUMNS = 4
+DEFAULT_TILE_WIDTH = 480
+MAX_TILES = 100
+MAX_CACHED_MOSAICS = 200
+MAX_SHEET_PIXELS = 25000000 # ~75 MB as an RGB image in memory
+BACKGROUND_COLOR = (0, 0, 0)
+
+# Pillow format name, file extension and maximum width/height for each supported output format
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 65535),
+    'png': ('PNG', 'png', None),
+    'webp': ('WEBP', 'webp', 16383),
+}
+
+def sheet_layout(count, columns, tile_width):
+    tile_height = tile_width * 3 // 4
+    columns = max(1, min(columns, count)) if count else 1
+    rows = max(1, (count + columns - 1) // columns)
+    return columns, rows, tile_height
+
+def sheet_size_error(count, columns, tile_width, fmt):
+    # Checked before building, since Pillow fails late (and only on save) for oversized sheets
+    columns, rows, tile_height = sheet_layout(min(count, MAX_TILES), columns, tile_width)
+    width, height = columns * tile_width, rows * tile_height
+    max_dimension = FORMATS[fmt][2]
+    if max_dimension and max(width, height) > max_dimension:
+        return f"Mosaic would be {width}x{height}, over the {fmt} limit of {max_dimension} pixels; use more columns or a smaller tile_width"
+    if width * height > MAX_SHEET_PIXELS:
+        return f"Mosaic would be {width}x{height}, over the limit of {MAX_SHEET_PIXELS} pixels; use a smaller tile_width"
+    return None
+
+@lru_cache(maxsize=4096)
+def _image_readable(path, mtime_ns, size):
+    # Fully decodes the image, since truncated files often have a valid header.
+    # Keyed on mtime and size so a rewritten file is checked again.
+    try:
+        with Image.open(path) as img:
+            img.load()
+        return True
+    except (OSError, SyntaxError, UnidentifiedImageError):
+        return False
+
+def image_readable(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return _image_readable(path, stat.st_mtime_ns, stat.st_size)
+
+def mosaic_key(filters, charts, missing_ids, columns, tile_width, fmt):
+    # Image filenames carry a download timestamp, so unlike chart ids (which
+    # restart after a full reset) they are never reused. Together with which
+    # images were missing or unreadable they pin the content.
+    payload = json.dumps({
+        'filters': filters,
+        'charts': [[chart['id'], chart['image_filename']] for chart in charts],
+        'missing_ids': missing_ids,
+        'columns': columns,
+        'tile_width': tile_width,
+        'format': fmt,
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+def get_mosaic(charts, filters, columns=DEFAULT_COLUMNS, tile_width=DEFAULT_TILE_WIDTH, fmt='jpeg'):
+    # Returns the coordinate map, building the image only if it isn't cached
+    total = len(charts)
+    charts = charts[:MAX_TILES]
+    missing_ids = [chart['id'] for chart in charts
+                   if not image_readable(os.path.join(IMAGES_DIR, chart['image_filename']))]
+    key = mosaic_key(filters, charts, missing_ids, columns, tile_width, fmt)
+    map_path = os.path.join(MOSAICS_DIR, f"{key}.json")
+
+    try:
+        with open(map_path, 'r') as f:
+            mosaic_map = json.load(f)
+        os.utime(map_path) # Mark as recently used so pruning keeps it
+    except FileNotFoundError:
+        os.makedirs(MOSAICS_DIR, exist_ok=True)
+        mosaic_map = build_mosaic(charts, key, set(missing_ids), columns, tile_width, fmt)
+
+        def write_map(path):
+            with open(path, 'w') as f:
+                json.dump(mosaic_map, f)
+        # The map is written last, so its presence means the image is complete
+        replace_atomic(map_path, write_map)
+        prune_cache()
+
+    # The total can change without the first MAX_TILES ids changing, so it isn't cached
+    mosaic_map['total'] = total
+    mosaic_map['truncated'] = total > len(charts)
+    return mosaic_map
+
+def replace_atomic(path, write):
+    # mkstemp gives each thread and process its own temp file, so concurrent
+    # builds of the same mosaic never clobber each other's partial writes
+    fd, tmp_path = tempfile.mkstemp(dir=MOSAICS_DIR, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another request finished the same file first, which is as good as a cache hit
+        if not os.path.exists(path):
+            raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def prune_cache():
+    # Keep the MAX_CACHED_MOSAICS most recently used mosaics. A map and its
+    # image share a key; images without a map are still being built.
+    map_mtimes = {}
+    paths_by_key = {}
+    for filename in os.listdir(MOSAICS_DIR):
+        key, ext = os.path.splitext(filename)
+        if ext == '.tmp':
+            continue
+        path = os.path.join(MOSAICS_DIR, filename)
+        paths_by_key.setdefault(key, []).append(path)
+        if ext == '.json':
+            try:
+                map_mtimes[key] = os.path.getmtime(path)
+            except OSError:
+                pass # Removed by a concurrent prune
+
+    oldest_first = sorted(map_mtimes, key=map_mtimes.get)
+    for key in oldest_first[:max(0, len(oldest_first) - MAX_CACHED_MOSAICS)]:
+        for path in paths_by_key[key]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def build_mosaic(charts, key, missing_ids, columns, tile_width, fmt):
+    pil_format, ext, _ = FORMATS[fmt]
+    columns, rows, tile_height = sheet_layout(len(charts), columns, tile_width)
+
+    sheet = Image.new('RGB', (columns * tile_width, rows * tile_height), BACKGROUND_COLOR)
+    tiles = []
+
+    for index, chart in enumerate(charts):
+        x = (index % columns) * tile_width
+        y = (index // columns) * tile_height
+
+        missing = chart['id'] in missing_ids
+        if not missing:
+            try:
+                with Image.open(os.path.join(IMAGES_DIR, chart['image_filename'])) as img:
+                    # Scale to fit the tile without cropping, centered on the background
+                    thumb = ImageOps.contain(img.convert('RGB'), (tile_width, tile_height))
+                    sheet.paste(thumb, (x + (tile_width - thumb.width) // 2, y + (tile_height - thumb.height) // 2))
+            except (OSError, UnidentifiedImageError):
+                missing = True # Removed or replaced since the readability check
+        if missing:
+            print(f"Mosaic: image missing or unreadable (leaving tile blank): {chart['image_filename']}")
+
+        tiles.append({
+            'id': chart['id'],
+            'ticker': chart['ticker'],
+            'chart_date': chart['chart_date'],
+            'period': chart['period'],
+            'x': x,
+            'y': y,
+            'width': tile_width,
+            'height': tile_height,
+            'missing': missing,
+        })
+
+    filename = f"{key}.{ext}"
+    def write_image(path):
+        if pil_format == 'PNG':
+            sheet.save(path, pil_format, optimize=True)
+        else:
+            sheet.save(path, pil_format, quality=80)
+    replace_atomic(os.path.join(MOSAICS_DIR, filename), write_image)
+
+    return {
+        'image': filename,
+        'width': sheet.width,
+        'height': sheet.height,
+        'columns': columns,
+        'rows': rows,
+        'tiles': tiles,
+    }